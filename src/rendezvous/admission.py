@@ -0,0 +1,158 @@
+import math
+import threading
+import time
+import logging
+
+log = logging.getLogger("admission")
+
+# Commands that hit the disk (full JSON rewrite + fsync under the DB lock).
+# Everything else (DISCOVER, errors) is cheap and gets priority under load.
+EXPENSIVE_COMMANDS = frozenset({"REGISTER", "UNREGISTER"})
+
+
+class AdmissionController:
+    """
+    Bounded admission in front of the worker pool.
+
+    - At most `max_pending` connections may be queued or running; the accept
+      loop rejects the rest right away with a "busy" reply (try_admit).
+    - Queue time ("sojourn": accept -> worker start) drives a CoDel-style
+      controller: once it has stayed above `target_ms` for a whole
+      `interval_ms`, expensive requests are shed at an increasing rate until
+      the queue drains. Cheap requests are only shed past `max_queue_ms`,
+      when the client has most likely given up anyway.
+    - At most `max_writes` expensive requests run at once, so writes stuck
+      behind the DB lock can't take every worker away from DISCOVER. A write
+      that finds no free slot is answered "busy" right away instead of
+      holding a worker while it waits.
+    """
+    def __init__(self, max_pending=256, max_writes=32, target_ms=100, interval_ms=1000,
+                 max_queue_ms=1000, retry_after=1):
+        self.max_pending = max_pending
+        self.max_writes = max_writes
+        self.target = target_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.max_queue = max_queue_ms / 1000.0
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._writes = threading.BoundedSemaphore(max_writes)
+        self._last_sojourn = 0.0
+
+        # CoDel state
+        self._first_above = 0.0
+        self._dropping = False
+        self._drop_next = 0.0
+        self._count = 0
+
+        self.rejected = 0   # refused at accept (max_pending)
+        self.shed = 0       # dropped by a worker (queue time / write slots)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def try_admit(self):
+        """Called by the accept loop; False means reply busy and close."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self._pending += 1
+            return True
+
+    def release(self, *_):
+        # usable directly as a Future done-callback
+        with self._lock:
+            self._pending -= 1
+
+    def retry_after_hint(self):
+        """Seconds a rejected client should wait: grows with the observed queue time."""
+        return min(30, max(self.retry_after, math.ceil(self._last_sojourn * 2)))
+
+    def busy_response(self):
+        return {"status": "ERROR", "message": "busy", "retry_after": self.retry_after_hint()}
+
+    def expired(self, sojourn):
+        """Queued past max_queue: drop without even reading the request."""
+        if sojourn > self.max_queue:
+            with self._lock:
+                self._last_sojourn = sojourn
+                self.shed += 1
+            return True
+        return False
+
+    def admit_request(self, command, sojourn, now=None):
+        """
+        Decide, once the command is known, whether to serve it. Every request
+        feeds the CoDel state; only expensive ones are dropped by it (and use
+        up its drop schedule).
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._last_sojourn = sojourn
+            drop = self._codel(sojourn, now, command in EXPENSIVE_COMMANDS)
+            if drop:
+                self.shed += 1
+        return not drop
+
+    def _codel(self, sojourn, now, expensive):
+        # MUST be called with self._lock held. Returns True when CoDel drops this
+        # request; cheap requests only update the state, never take a drop.
+        ok_to_drop = False
+        if sojourn < self.target:
+            self._first_above = 0.0
+        elif self._first_above == 0.0:
+            self._first_above = now + self.interval
+        elif now >= self._first_above:
+            ok_to_drop = True
+
+        if self._dropping:
+            if not ok_to_drop:
+                self._dropping = False
+                log.info("Queue time back under %.0fms; leaving drop state", self.target * 1000)
+                return False
+            if expensive and now >= self._drop_next:
+                self._count += 1
+                self._drop_next = now + self.interval / math.sqrt(self._count)
+                return True
+            return False
+
+        if ok_to_drop:
+            self._dropping = True
+            # resume near the previous drop rate if we only just left the drop state
+            recent = now - self._drop_next < 16 * self.interval
+            self._count = max(1, self._count - 2) if recent else 1
+            log.warning("Queue time above %.0fms for %.0fms; shedding expensive requests",
+                        self.target * 1000, self.interval * 1000)
+            if not expensive:
+                # the entry drop goes to the next expensive request instead
+                self._count -= 1
+                self._drop_next = now
+                return False
+            self._drop_next = now + self.interval / math.sqrt(self._count)
+            return True
+        return False
+
+    def acquire_write(self):
+        """Take one of the `max_writes` write slots, without waiting for one."""
+        if self._writes.acquire(blocking=False):
+            return True
+        with self._lock:
+            self.shed += 1
+        return False
+
+    def release_write(self):
+        self._writes.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "dropping": self._dropping,
+                "last_queue_ms": round(self._last_sojourn * 1000, 3),
+                "rejected": self.rejected,
+                "shed": self.shed,
+            }
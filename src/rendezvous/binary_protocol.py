@@ -0,0 +1,301 @@
+import struct
+import logging
+from protocol_parser import Request
+
+log = logging.getLogger("parser")
+
+# Frame: MAGIC (1 byte) | VERSION (1 byte) | body length (uint32, big endian) | body
+#
+# MAGIC is a UTF-8 continuation byte, so it can never start a text (JSON) line:
+# a connection negotiates the binary framing simply by sending it as first byte.
+MAGIC = 0xB7
+VERSION = 1
+HEADER = struct.Struct("!BBI")
+
+# Value tags
+T_NONE = b"N"[0]
+T_TRUE = b"T"[0]
+T_FALSE = b"F"[0]
+T_INT = b"i"[0]      # zigzag varint
+T_FLOAT = b"d"[0]    # IEEE 754 double
+T_STR = b"s"[0]      # varint length + UTF-8
+T_LIST = b"l"[0]     # varint count + values
+T_DICT = b"m"[0]     # varint count + (key, value) pairs
+T_TABLE = b"t"[0]    # list of dicts sharing the same keys (see _encode_table)
+T_STRREF = b"r"[0]   # varint index into the enclosing table's string table
+
+_DOUBLE = struct.Struct("!d")
+
+# Decoder limits: nesting of lists/dicts/tables, and varint length (64 bits)
+MAX_DEPTH = 32
+MAX_VARINT_BYTES = 10
+
+
+class FrameError(ValueError):
+    pass
+
+
+def _put_varint(out, n):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(buf, pos):
+    shift = 0
+    n = 0
+    end = pos + MAX_VARINT_BYTES
+    while True:
+        if pos >= end:
+            raise FrameError("varint too long")
+        try:
+            b = buf[pos]
+        except IndexError:
+            raise FrameError("truncated varint")
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return n, pos
+        shift += 7
+
+
+def _put_raw_str(out, s):
+    data = s.encode("utf-8")
+    _put_varint(out, len(data))
+    out += data
+
+
+def _get_raw_str(buf, pos):
+    n, pos = _get_varint(buf, pos)
+    if pos + n > len(buf):
+        raise FrameError("truncated string")
+    return bytes(buf[pos:pos + n]).decode("utf-8"), pos + n
+
+
+def _is_table(value):
+    # Peer lists (and any other list of uniform records) go out as a table
+    if len(value) < 2 or not all(type(v) is dict for v in value):
+        return False
+    keys = value[0].keys()
+    if not keys:
+        return False  # rows would cost nothing on the wire; the decoder rejects that
+    return all(isinstance(k, str) for k in keys) and all(v.keys() == keys for v in value)
+
+
+def _encode_table(out, rows):
+    """
+    Columns are sent once, then each row as a tuple of values in column order.
+    Every string inside the rows (namespace, ip, name...) is replaced by a
+    reference into a per-table string table, so repeated values cost 1-2 bytes.
+    """
+    keys = list(rows[0])
+    strings = {}
+    body = bytearray()
+    append = body.append
+    for row in rows:
+        for k in keys:
+            v = row[k]
+            t = type(v)
+            # inline fast paths for the common peer fields; rest goes generic
+            if t is str:
+                idx = strings.get(v)
+                if idx is None:
+                    idx = strings[v] = len(strings)
+                append(T_STRREF)
+                if idx < 0x80:
+                    append(idx)
+                else:
+                    _put_varint(body, idx)
+            elif t is int:
+                z = (v << 1) if v >= 0 else ((-v << 1) - 1)
+                append(T_INT)
+                if z < 0x80:
+                    append(z)
+                else:
+                    _put_varint(body, z)
+            else:
+                _encode_value(body, v)
+
+    out.append(T_TABLE)
+    _put_varint(out, len(keys))
+    for k in keys:
+        _put_raw_str(out, k)
+    _put_varint(out, len(strings))
+    for s in strings:  # insertion order == index order
+        _put_raw_str(out, s)
+    _put_varint(out, len(rows))
+    out += body
+
+
+def _encode_value(out, value):
+    if value is None:
+        out.append(T_NONE)
+    elif value is True:
+        out.append(T_TRUE)
+    elif value is False:
+        out.append(T_FALSE)
+    elif isinstance(value, int):
+        out.append(T_INT)
+        _put_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+    elif isinstance(value, float):
+        out.append(T_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        out.append(T_STR)
+        _put_raw_str(out, value)
+    elif isinstance(value, dict):
+        out.append(T_DICT)
+        _put_varint(out, len(value))
+        for k, v in value.items():
+            _put_raw_str(out, str(k))
+            _encode_value(out, v)
+    elif isinstance(value, (list, tuple)):
+        if _is_table(value):
+            _encode_table(out, value)
+        else:
+            out.append(T_LIST)
+            _put_varint(out, len(value))
+            for v in value:
+                _encode_value(out, v)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _decode_value(buf, pos, strings=None, depth=0):
+    try:
+        tag = buf[pos]
+    except IndexError:
+        raise FrameError("truncated value")
+    pos += 1
+
+    if tag == T_NONE:
+        return None, pos
+    if tag == T_TRUE:
+        return True, pos
+    if tag == T_FALSE:
+        return False, pos
+    if tag == T_INT:
+        n, pos = _get_varint(buf, pos)
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    if tag == T_FLOAT:
+        if pos + 8 > len(buf):
+            raise FrameError("truncated float")
+        return _DOUBLE.unpack_from(buf, pos)[0], pos + 8
+    if tag == T_STR:
+        return _get_raw_str(buf, pos)
+    if tag == T_STRREF:
+        idx, pos = _get_varint(buf, pos)
+        if strings is None or idx >= len(strings):
+            raise FrameError("bad string reference")
+        return strings[idx], pos
+    if tag in (T_LIST, T_DICT, T_TABLE):
+        depth += 1
+        if depth > MAX_DEPTH:
+            raise FrameError("value nested too deeply")
+    if tag == T_LIST:
+        n, pos = _get_varint(buf, pos)
+        items = []
+        for _ in range(n):
+            v, pos = _decode_value(buf, pos, None, depth)
+            items.append(v)
+        return items, pos
+    if tag == T_DICT:
+        n, pos = _get_varint(buf, pos)
+        d = {}
+        for _ in range(n):
+            k, pos = _get_raw_str(buf, pos)
+            d[k], pos = _decode_value(buf, pos, None, depth)
+        return d, pos
+    if tag == T_TABLE:
+        ncols, pos = _get_varint(buf, pos)
+        if ncols > len(buf) - pos:
+            raise FrameError("bad table column count")
+        keys = []
+        for _ in range(ncols):
+            k, pos = _get_raw_str(buf, pos)
+            keys.append(k)
+        nstr, pos = _get_varint(buf, pos)
+        if nstr > len(buf) - pos:
+            raise FrameError("bad table string count")
+        table = []
+        for _ in range(nstr):
+            s, pos = _get_raw_str(buf, pos)
+            table.append(s)
+        nrows, pos = _get_varint(buf, pos)
+        # every row takes at least one byte per column: counts larger than
+        # what is left of the frame would only allocate before failing
+        if (ncols == 0 and nrows > 0) or nrows > len(buf) - pos:
+            raise FrameError("bad table row count")
+        rows = []
+        for _ in range(nrows):
+            row = {}
+            for k in keys:
+                row[k], pos = _decode_value(buf, pos, table, depth)
+            rows.append(row)
+        return rows, pos
+
+    raise FrameError(f"unknown tag 0x{tag:02x}")
+
+
+def encode_frame(obj):
+    """Encode a request/response object as one binary frame (bytes)."""
+    body = bytearray(HEADER.size)
+    _encode_value(body, obj)
+    HEADER.pack_into(body, 0, MAGIC, VERSION, len(body) - HEADER.size)
+    return bytes(body)
+
+
+def frame_length(header):
+    """
+    Total frame size (header included) announced by `header`, which must hold
+    at least HEADER.size bytes. Raises FrameError on a bad magic/version.
+    """
+    magic, version, length = HEADER.unpack_from(header, 0)
+    if magic != MAGIC or version != VERSION:
+        raise FrameError(f"bad frame header (magic=0x{magic:02x}, version={version})")
+    return HEADER.size + length
+
+
+def decode_body(body):
+    """Decode a frame body (without header) into a Python object."""
+    obj, pos = _decode_value(body, 0)
+    if pos != len(body):
+        raise FrameError("trailing bytes after value")
+    return obj
+
+
+def decode_frame(frame):
+    """Decode one complete frame (header included) into a Python object."""
+    total = frame_length(frame)
+    if len(frame) != total:
+        raise FrameError(f"frame length mismatch ({len(frame)} != {total})")
+    return decode_body(memoryview(frame)[HEADER.size:])
+
+
+class BinaryProtocolParser:
+    """
+    Length-prefixed binary alternative to ProtocolParser (same parse/encode
+    interface). Request/response objects are the same as in the JSON protocol;
+    lists of uniform records (DISCOVER peer lists) are sent as tuple rows with
+    a string table instead of repeating keys and namespace strings per peer.
+    """
+    def parse(self, raw_data):
+        try:
+            data = decode_frame(raw_data)
+
+            if not isinstance(data, dict) or not isinstance(data.get("type"), str):
+                log.warning("Missing 'type' in binary frame (%d bytes)", len(raw_data))
+                return Request("ERROR", {"message": "missing_type"})
+
+            return Request(data.get("type").upper(), data)
+
+        except (FrameError, UnicodeDecodeError, struct.error) as e:
+            log.warning("Invalid binary frame (%d bytes): %s", len(raw_data), e)
+            return Request("ERROR", {"message": "invalid_frame"})
+        except Exception:
+            log.exception("Unexpected parser error")
+            return Request("ERROR", {"message": "invalid_frame"})
+
+    def encode(self, obj):
+        return encode_frame(obj)
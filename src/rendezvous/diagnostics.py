@@ -0,0 +1,274 @@
+import cProfile
+import math
+import pstats
+import threading
+import time
+import logging
+from pathlib import Path
+
+log = logging.getLogger("diagnostics")
+
+# Number of enabled SlowRequestTracer instances. Everything below checks this
+# plain global first, so with tracing off the hooks cost one global lookup.
+# Only changed under _tracing_lock.
+_tracing = 0
+_tracing_lock = threading.Lock()
+_local = threading.local()
+
+
+def current_trace():
+    """RequestTrace of the request running on this thread, or None."""
+    if not _tracing:
+        return None
+    return getattr(_local, "trace", None)
+
+
+class RequestTrace:
+    """Per-request phase timings (seconds), filled in by the thread serving it."""
+    __slots__ = ("started", "last", "phases")
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.last = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, phase):
+        """Close `phase` at now: it gets the time elapsed since the previous mark."""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    def add(self, phase, seconds):
+        """Account a nested sub-phase (e.g. DB lock wait inside the handler)."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def total(self):
+        return self.last - self.started
+
+
+class SlowRequestTracer:
+    """
+    Logs the per-phase breakdown of requests slower than `threshold_ms`.
+    Disabled when the threshold is None; can be changed at runtime.
+    """
+    def __init__(self, threshold_ms=None):
+        self.threshold = None
+        self.set_threshold(threshold_ms)
+
+    @property
+    def enabled(self):
+        return self.threshold is not None
+
+    def set_threshold(self, threshold_ms):
+        """None disables tracing. Raises ValueError for non-finite or negative thresholds."""
+        global _tracing
+        threshold = None
+        if threshold_ms is not None:
+            threshold = float(threshold_ms) / 1000.0
+            if not math.isfinite(threshold) or threshold < 0:
+                raise ValueError(f"invalid slow-request threshold: {threshold_ms!r}")
+
+        with _tracing_lock:
+            was_enabled = self.enabled
+            self.threshold = threshold
+            if self.enabled and not was_enabled:
+                _tracing += 1
+            elif was_enabled and not self.enabled:
+                _tracing -= 1
+        log.info("Slow-request tracing %s",
+                 f"enabled (threshold={threshold_ms}ms)" if self.enabled else "disabled")
+
+    def begin(self, accepted_at=None):
+        """Start tracing the current thread's request; returns the trace or None."""
+        if self.threshold is None:
+            return None
+        trace = RequestTrace(accepted_at)
+        if accepted_at is not None:
+            trace.add("accept_wait", trace.last - accepted_at)
+        _local.trace = trace
+        return trace
+
+    def end(self, trace, peer, command):
+        _local.trace = None
+        # Close the trace at the real end of the request. Early returns (recv
+        # timeout, line too long, busy, empty line) skip the later marks, and
+        # total() only reaches the last one.
+        if "send" in trace.phases:
+            trace.mark("send")
+        elif "recv" not in trace.phases:
+            trace.mark("recv")
+        else:
+            trace.mark("abort")
+        threshold = self.threshold
+        total = trace.total()
+        if threshold is None or total < threshold:
+            return
+        breakdown = " ".join(f"{k}={v * 1000:.2f}ms" for k, v in trace.phases.items())
+        log.warning("Slow request from %s (%s): total=%.2fms %s",
+                    peer, command, total * 1000, breakdown)
+
+
+class InstrumentedLock:
+    """
+    Drop-in wrapper for threading.Lock/RLock that can count contention
+    (acquisitions, contended acquisitions, wait time). When counting is off and
+    no request is being traced, acquire() goes straight to the wrapped lock.
+
+    If `phase` is given, time spent waiting for the lock is also added to the
+    current request trace under that name.
+    """
+    def __init__(self, lock, name, phase=None):
+        self._lock = lock
+        self.name = name
+        self.phase = phase
+        self.enabled = False
+        self._stats_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._stats_lock:
+            self.acquisitions = 0
+            self.contended = 0
+            self.wait_time = 0.0
+            self.max_wait = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self.enabled and not _tracing:
+            return self._lock.acquire(blocking, timeout)
+
+        waited = 0.0
+        contended = not self._lock.acquire(False)
+        if contended:
+            if not blocking:
+                ok = False
+            else:
+                t0 = time.perf_counter()
+                ok = self._lock.acquire(True, timeout)
+                waited = time.perf_counter() - t0
+        else:
+            ok = True
+
+        if self.enabled:
+            with self._stats_lock:
+                self.acquisitions += 1
+                if contended:
+                    self.contended += 1
+                    self.wait_time += waited
+                    if waited > self.max_wait:
+                        self.max_wait = waited
+        if self.phase and waited:
+            trace = current_trace()
+            if trace is not None:
+                trace.add(self.phase, waited)
+        return ok
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+    def snapshot(self):
+        with self._stats_lock:
+            return {
+                "lock": self.name,
+                "enabled": self.enabled,
+                "acquisitions": self.acquisitions,
+                "contended": self.contended,
+                "wait_ms": round(self.wait_time * 1000, 3),
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+
+class RequestProfiler:
+    """
+    On-demand cProfile: while a window is open every request is profiled on its
+    worker thread; when the window closes the merged stats are dumped to
+    `out_dir/profile-<timestamp>-<ms>.pstats` (open with `python -m pstats`).
+    Windows are capped at MAX_SECONDS and can be closed early with stop().
+    """
+    MAX_SECONDS = 300
+
+    def __init__(self, out_dir="."):
+        self.out_dir = out_dir
+        self.active = False
+        self._lock = threading.Lock()
+        self._stats = None
+        self._requests = 0
+        self._timer = None
+
+    def start(self, seconds):
+        """
+        Open a window of `seconds` (capped at MAX_SECONDS). Returns the actual
+        window length, or None if one is already open. Raises ValueError for
+        non-finite or non-positive durations.
+        """
+        seconds = float(seconds)
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError(f"invalid profiling window: {seconds!r}")
+        seconds = min(seconds, self.MAX_SECONDS)
+
+        with self._lock:
+            if self.active:
+                log.warning("Profiler already running; ignoring new request")
+                return None
+            self.active = True
+            self._stats = None
+            self._requests = 0
+            timer = threading.Timer(seconds, lambda: self._expire(timer))
+            timer.daemon = True
+            self._timer = timer
+            timer.start()
+        log.info("Profiling requests for %.1fs", seconds)
+        return seconds
+
+    def begin(self):
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # another profiler already active on this thread
+            return None
+        return prof
+
+    def end(self, prof):
+        prof.disable()
+        with self._lock:
+            if not self.active:
+                return  # window closed while this request was running
+            if self._stats is None:
+                self._stats = pstats.Stats(prof)
+            else:
+                self._stats.add(prof)
+            self._requests += 1
+
+    def _expire(self, timer):
+        # a timer only closes the window it was started for
+        with self._lock:
+            if self._timer is not timer:
+                return
+        self.stop()
+
+    def stop(self):
+        with self._lock:
+            self.active = False
+            if self._timer is not None:
+                self._timer.cancel()  # no-op when the timer itself got here
+                self._timer = None
+            stats, self._stats = self._stats, None
+            requests = self._requests
+        if stats is None:
+            log.info("Profiling window closed; no requests were profiled")
+            return None
+
+        now = time.time()
+        # milliseconds: back-to-back windows (stop + start) must not overwrite
+        name = time.strftime("profile-%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}.pstats"
+        path = Path(self.out_dir).expanduser() / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(str(path))
+        log.info("Profiling window closed; %d request(s) profiled, stats written to %s", requests, path)
+        return path
@@ -70,9 +70,82 @@ if __name__ == "__main__":
         help="Port for the rendezvous server (default: 8080).",
     )
     
+    parser.add_argument(
+        "--slow-ms",
+        type=float,
+        default=None,
+        help="Log a per-phase breakdown of requests slower than this many ms (default: off).",
+    )
+    
+    parser.add_argument(
+        "--profile-dir",
+        default=".",
+        help="Directory for profile-*.pstats dumps (default: current directory).",
+    )
+    
+    parser.add_argument(
+        "--profile-seconds",
+        type=float,
+        default=30,
+        help="Profiling window started by SIGUSR1 (default: 30s).",
+    )
+    
+    parser.add_argument(
+        "--lock-stats",
+        action="store_true",
+        help="Start with lock-contention counters enabled (toggle at runtime with SIGUSR2).",
+    )
+    
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=256,
+        help="Max connections queued or in service; extra ones get an immediate 'busy' (default: 256).",
+    )
+    
+    parser.add_argument(
+        "--max-writes",
+        type=int,
+        default=32,
+        help="Max REGISTER/UNREGISTER requests served at once; extra ones get an immediate 'busy' (default: 32).",
+    )
+    
+    parser.add_argument(
+        "--queue-target-ms",
+        type=float,
+        default=100,
+        help="Queue time above which expensive requests start being shed (default: 100ms).",
+    )
+    
+    parser.add_argument(
+        "--max-queue-ms",
+        type=float,
+        default=1000,
+        help="Queue time after which any request is answered 'busy' unread (default: 1000ms).",
+    )
+    
+    parser.add_argument(
+        "--compress-min-bytes",
+        type=int,
+        default=1024,
+        help="Only compress responses (when the client asks) at least this large (default: 1024).",
+    )
+    
     args = parser.parse_args()
 
     setup_logging(args.log_mode, args.log_file)
     
-    server = RendezvousServer(args.host, args.port)
+    server = RendezvousServer(
+        args.host,
+        args.port,
+        slow_request_ms=args.slow_ms,
+        profile_dir=args.profile_dir,
+        profile_seconds=args.profile_seconds,
+        lock_stats=args.lock_stats,
+        max_pending=args.max_pending,
+        max_writes=args.max_writes,
+        queue_target_ms=args.queue_target_ms,
+        max_queue_ms=args.max_queue_ms,
+        compress_min_bytes=args.compress_min_bytes,
+    )
     server.start()
@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from typing import Optional
 
-@dataclass
+@dataclass(frozen=True)
 class PeerRecord:
     ip : str
     port: int
@@ -3,15 +3,41 @@ import os
 from models import PeerRecord
 from datetime import datetime, timezone
 import threading
+import time
 import logging
+import diagnostics
 
 log = logging.getLogger("peer_db")
 
+
+class Snapshot:
+    """
+    Immutable view of the DB published by writers. Readers grab the current
+    one with a single attribute read (atomic), so they never take the lock and
+    never see a half-applied write.
+    """
+    __slots__ = ("version", "all", "by_namespace")
+
+    def __init__(self, version, peers):
+        self.version = version
+        # (record, expiry epoch) pairs, in insertion order. Built from a list:
+        # tuple(<generator>) resizes the tuple in place, which fails if another
+        # thread got hold of it meanwhile (e.g. via gc.get_objects()).
+        self.all = tuple([(p, p.timestamp.timestamp() + p.ttl) for p in peers])
+        by_namespace = {}
+        for entry in self.all:
+            by_namespace.setdefault(entry[0].namespace, []).append(entry)
+        self.by_namespace = {ns: tuple(entries) for ns, entries in by_namespace.items()}
+
+
 class PeerDatabase:
     def __init__(self, filename="peers.json"):
         self.filename = filename
-        self._lock = threading.RLock()
+        # Writers only; readers use self._snapshot.
+        # lock wait time shows up as "db_lock_wait" in slow-request traces
+        self._lock = diagnostics.InstrumentedLock(threading.RLock(), "PeerDatabase._lock", phase="db_lock_wait")
         self.peers = self._load()
+        self._snapshot = Snapshot(0, self.peers)
 
     def _load(self):
         if not os.path.exists(self.filename):
@@ -53,6 +79,8 @@ class PeerDatabase:
 
     def _save_locked(self):
         # MUST be called with self._lock held
+        trace = diagnostics.current_trace()
+        started = time.perf_counter() if trace is not None else 0.0
         tmpf = self.filename + ".tmp"
 
         # prepara conteúdo serializável
@@ -73,8 +101,19 @@ class PeerDatabase:
             os.fsync(f.fileno())
         os.replace(tmpf, self.filename)
         
+        if trace is not None:
+            trace.add("persist", time.perf_counter() - started)
         log.info("Saved %d peer(s) into %s", len(self.peers), self.filename)
         
+    def _publish_locked(self):
+        # MUST be called with self._lock held, after every change to self.peers
+        self._snapshot = Snapshot(self._snapshot.version + 1, self.peers)
+
+    @property
+    def version(self):
+        """Bumped on every published change (cache key for derived data)."""
+        return self._snapshot.version
+
     def _save(self):
         with self._lock:
             self._save_locked()
@@ -84,6 +123,8 @@ class PeerDatabase:
             before = len(self.peers)
             self.peers = [p for p in self.peers if not p.is_expired()]
             expired = before - len(self.peers)
+            if expired:
+                self._publish_locked()
         if expired:
             log.info("Expired %d peer(s) removed", expired)
 
@@ -105,6 +146,8 @@ class PeerDatabase:
             if not updated:
                 self.peers.append(peer)
             
+            # readers see the change as soon as it is in memory, not after the fsync
+            self._publish_locked()
             self._save_locked()
 
     def remove_peer(self, ip : str, namespace : str, name=None, port=None):
@@ -128,6 +171,7 @@ class PeerDatabase:
             removed = before - len(self.peers)
             log.info("Removed %d peer(s) ip=%s ns=%s name=%r port=%r",
                      removed, ip, namespace, name, port)
+            self._publish_locked()
             
             # Persist under the same lock to keep file and memory in sync.
             self._save_locked()
@@ -135,12 +179,18 @@ class PeerDatabase:
         
 
     def get_peers(self, namespace=None):
-        with self._lock:
-            self._sweep()
-            if namespace:
-                return [p for p in self.peers if p.namespace == namespace]
-            return self.peers  # return a shallow copy
+        """
+        Live peers (of `namespace`, or all). Lock-free: reads the current
+        snapshot and skips expired entries; the list returned is the caller's.
+        """
+        if namespace and not isinstance(namespace, str):
+            # e.g. a list/dict sent by a client: no such namespace (and unhashable)
+            return []
+        snap = self._snapshot
+        entries = snap.by_namespace.get(namespace, ()) if namespace else snap.all
+        now = time.time()
+        return [p for p, expires in entries if expires >= now]
     
     def get_all_db(self):
-        with self._lock:
-            return list(self.peers)
+        return [p for p, _ in self._snapshot.all]
+
@@ -1,4 +1,3 @@
-
 import json
 import logging
 
@@ -12,8 +11,16 @@ class Request:
 
 class ProtocolParser:
     def parse(self, raw_data):
+        """
+        Parse one request line. `raw_data` may be bytes (preferred: json.loads
+        decodes it once, without an intermediate str copy) or str.
+        """
         try:
-            data = json.loads(raw_data)
+            try:
+                data = json.loads(raw_data)
+            except UnicodeDecodeError:
+                # keep the old lenient behaviour for non-UTF-8 garbage
+                data = json.loads(raw_data.decode("utf-8", errors="replace"))
             
             if not isinstance(data.get("type"), str):
                 log.warning("Missing 'type' in JSON: %s", raw_data)
@@ -28,4 +35,8 @@ class ProtocolParser:
         except Exception:
             log.exception("Unexpected parser error")
             return Request("ERROR", {"message": "Invalid JSON"})
-        
\ No newline at end of file
+
+    def encode(self, obj):
+        """Encode a response object as one newline-terminated JSON line (bytes)."""
+        return (json.dumps(obj) + "\n").encode("utf-8")
+        
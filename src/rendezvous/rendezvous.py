@@ -1,11 +1,16 @@
 
 import socket
+import signal
 import threading
 import time
 from collections import defaultdict, deque
 from peer_db import PeerDatabase
 from protocol_parser import ProtocolParser
+from binary_protocol import BinaryProtocolParser
+import binary_protocol
 from request_handler import RequestHandler
+from diagnostics import InstrumentedLock, RequestProfiler, SlowRequestTracer
+from admission import AdmissionController, EXPENSIVE_COMMANDS
 import json
 import logging
 
@@ -13,6 +18,19 @@ import logging
 log = logging.getLogger("rendezvous")
 
 MAX_LINE = 32 * 1024  # 32KB
+RECV_CHUNK = 4096
+
+# Fixed error replies, encoded once (JSON line / binary frame)
+LINE_TOO_LONG = {"status": "ERROR","message": "line_too_long","limit": MAX_LINE}
+TIMEOUT = {"status": "ERROR", "message": "Timeout: no data received, closing connection"}
+LINE_TOO_LONG_MSG = (json.dumps(LINE_TOO_LONG) + "\n").encode("utf-8")
+LINE_TOO_LONG_FRAME = binary_protocol.encode_frame(LINE_TOO_LONG)
+TIMEOUT_MSG = (json.dumps(TIMEOUT) + "\n").encode("utf-8")
+TIMEOUT_FRAME = binary_protocol.encode_frame(TIMEOUT)
+EMPTY_LINE_MSG = (json.dumps({"status": "ERROR", "message": "Empty request line"}) + "\n").encode("utf-8")
+
+# ADMIN commands are only honoured from these addresses
+ADMIN_IPS = ("127.0.0.1", "::1")
 
 class RendezvousServer:
     """
@@ -38,12 +56,16 @@ class RendezvousServer:
     - Consider using external rate-limiting solutions (e.g., fail2ban, iptables)
       for more sophisticated protection
     """
-    def __init__(self, host='0.0.0.0', port=5000, max_attempts=50, window_seconds=60, block_time=60):
+    def __init__(self, host='0.0.0.0', port=5000, max_attempts=50, window_seconds=60, block_time=60,
+                 slow_request_ms=None, profile_dir=".", profile_seconds=30, lock_stats=False,
+                 max_pending=256, max_writes=32, queue_target_ms=100, max_queue_ms=1000,
+                 compress_min_bytes=1024):
         self.host = host
         self.port = port
         self.peer_db = PeerDatabase()
         self.parser = ProtocolParser()
-        self.handler = RequestHandler(self.peer_db)
+        self.binary_parser = BinaryProtocolParser()
+        self.handler = RequestHandler(self.peer_db, compress_min_bytes=compress_min_bytes)
         
         # IP blocking configuration
         self.max_attempts = max_attempts  # Maximum connection attempts in the time window
@@ -53,17 +75,177 @@ class RendezvousServer:
         # Thread-safe data structures for IP blocking
         self.attempts = defaultdict(deque)  # IP -> deque of connection timestamps
         self.blocked_ips = {}  # IP -> block timestamp
-        self.attempts_lock = threading.Lock()  # Lock to protect shared data structures
+        self.attempts_lock = InstrumentedLock(threading.Lock(), "attempts_lock")  # Lock to protect shared data structures
+        
+        # Bounded admission / overload shedding in front of the worker pool
+        self.admission = AdmissionController(
+            max_pending=max_pending,
+            max_writes=max_writes,
+            target_ms=queue_target_ms,
+            max_queue_ms=max_queue_ms,
+        )
+        
+        # Diagnostics (all off by default; toggled at runtime via ADMIN or signals)
+        self.tracer = SlowRequestTracer(slow_request_ms)
+        self.profiler = RequestProfiler(profile_dir)
+        self.profile_seconds = profile_seconds
+        self.set_lock_stats(lock_stats)
+        
+        # Per-worker receive buffers (allocated once per pool thread, reused)
+        self._tls = threading.local()
+        
+    def _recv_buffer(self):
+        view = getattr(self._tls, "recv_view", None)
+        if view is None:
+            # room for one extra chunk past the limit, so an over-long line is
+            # read (and rejected) exactly like before, without ever growing
+            view = memoryview(bytearray(MAX_LINE + RECV_CHUNK))
+            self._tls.recv_view = view
+        return view
+        
+    def set_lock_stats(self, enabled, reset=False):
+        """Turn lock-contention counters on/off for the DB and attempts locks."""
+        stats = []
+        for lock in (self.peer_db._lock, self.attempts_lock):
+            lock.enabled = enabled
+            if reset:
+                lock.reset()
+            stats.append(lock.snapshot())
+        return stats
+    
+    def _handle_admin(self, args):
+        """Runtime diagnostics control, e.g. {"type": "ADMIN", "action": "profile", "seconds": 10}."""
+        action = args.get("action")
+        try:
+            if action == "profile":
+                seconds = self.profiler.start(args.get("seconds", self.profile_seconds))
+                if seconds is None:
+                    return {"status": "ERROR", "message": "profiler_busy"}
+                return {"status": "OK", "seconds": seconds, "dir": str(self.profiler.out_dir)}
+            
+            if action == "stop":
+                if not self.profiler.active:
+                    return {"status": "ERROR", "message": "profiler_idle"}
+                path = self.profiler.stop()
+                return {"status": "OK", "file": None if path is None else str(path)}
+            
+            if action == "slow_trace":
+                # threshold_ms: null disables tracing
+                threshold = args.get("threshold_ms")
+                self.tracer.set_threshold(threshold)
+                return {"status": "OK", "threshold_ms": None if threshold is None else float(threshold)}
+            
+            if action == "lock_stats":
+                enabled = args.get("enable")
+                if enabled is None:
+                    enabled = self.attempts_lock.enabled
+                return {"status": "OK", "locks": self.set_lock_stats(bool(enabled), bool(args.get("reset")))}
+            
+            if action == "admission":
+                return {"status": "OK", "admission": self.admission.snapshot()}
+        
+        except (ValueError, TypeError):
+            return {"status": "ERROR", "message": "bad_argument"}
+        
+        return {"status": "ERROR", "message": "bad_action"}
+    
+    def _install_signal_handlers(self):
+        """
+        SIGUSR1: profile requests for `profile_seconds` and dump the stats file.
+        SIGUSR2: toggle lock-contention counters (counters are logged when turned off).
+        """
+        if not hasattr(signal, "SIGUSR1"):
+            return  # not available on Windows
+        
+        def start_profiler():
+            try:
+                self.profiler.start(self.profile_seconds)
+            except ValueError as e:
+                log.error("Cannot start profiler: %s", e)
+        
+        def on_usr1(signum, frame):
+            # keep the handler trivial; do the work (and logging) off the main thread
+            threading.Thread(target=start_profiler, daemon=True).start()
         
+        def toggle_lock_stats():
+            enabled = not self.attempts_lock.enabled
+            for stats in self.set_lock_stats(enabled, reset=enabled):
+                log.info("Lock stats: %s", stats)
         
-    def handle_client(self, connection, address):
+        def on_usr2(signum, frame):
+            threading.Thread(target=toggle_lock_stats, daemon=True).start()
+        
+        try:
+            signal.signal(signal.SIGUSR1, on_usr1)
+            signal.signal(signal.SIGUSR2, on_usr2)
+        except ValueError:
+            log.debug("Not in main thread; diagnostics signals not installed")
+    
+    def _busy_payload(self, codec):
+        # compact on purpose: under overload every byte and cycle counts
+        response = self.admission.busy_response()
+        if codec is self.parser:
+            return (json.dumps(response, separators=(",", ":")) + "\n").encode("utf-8")
+        return codec.encode(response)
+    
+    def _drain_codec(self, connection):
+        """
+        For replies sent without reading the request: whatever the client
+        already sent is drained (without blocking) so closing doesn't reset the
+        connection before the reply is read, and tells which framing to answer
+        in. Requests not arrived yet get the default JSON reply.
+        """
+        codec = self.parser
+        try:
+            connection.setblocking(False)
+            first = connection.recv(RECV_CHUNK)
+            if first[:1] == bytes((binary_protocol.MAGIC,)):
+                codec = self.binary_parser
+        except OSError:
+            pass
+        return codec
+    
+    def _reject_busy(self, connection):
+        """Refuse a connection without reading its request."""
+        codec = self._drain_codec(connection)
+        try:
+            connection.setblocking(True)
+            connection.settimeout(0.5)
+            connection.sendall(self._busy_payload(codec))
+        except OSError:
+            pass
+    
+    def _serve(self, request, client_ip, codec, sojourn):
+        """Run the request through admission (priority/shedding) and the handler."""
+        if request.command == "ADMIN" and client_ip in ADMIN_IPS:
+            response = self._handle_admin(request.args)
+            return response["status"], codec.encode(response)
+        
+        if not self.admission.admit_request(request.command, sojourn):
+            log.warning("Shedding %s from %s (queued %.0fms)", request.command, client_ip, sojourn * 1000)
+            return "ERROR", self._busy_payload(codec)
+        
+        if request.command not in EXPENSIVE_COMMANDS:
+            return self.handler.handle(request, client_ip, codec)
+        
+        # no waiting for a slot: a blocked writer would hold a worker DISCOVER needs
+        if not self.admission.acquire_write():
+            log.warning("No write slot for %s from %s; sending busy", request.command, client_ip)
+            return "ERROR", self._busy_payload(codec)
+        try:
+            return self.handler.handle(request, client_ip, codec)
+        finally:
+            self.admission.release_write()
+    
+    def handle_client(self, connection, address, accepted_at=None):
+        # time spent waiting in the pool queue
+        sojourn = time.perf_counter() - accepted_at if accepted_at is not None else 0.0
         connection.settimeout(1)
-        buf = b""
-        line = None
         peer = f"{address[0]}:{address[1]}"
         client_ip = address[0]
         
         # IP blocking check with thread-safe access
+        blocked_msg = None
         with self.attempts_lock:
             now = time.time()
             
@@ -77,120 +259,168 @@ class RendezvousServer:
                     log.warning(f"Connection from {peer} blocked due to too many attempts "
                                f"({int(self.block_time - time_since_block)}s remaining)")
                     
-                    msg = json.dumps({
+                    blocked_msg = {
                         "status": "ERROR",
                         "message": f"Connection from {peer} has been blocked due to excessive login attempts (limit: {self.max_attempts}). The block will be lifted in {int(self.block_time - time_since_block)} seconds."
-                    })
-                    
-                    try:
-                        connection.sendall((msg + "\n").encode("utf-8"))
-                        
-                        connection.shutdown(socket.SHUT_RDWR)
-                    except Exception:
-                        pass
-                    
-                    connection.close()
-                    return
+                    }
                 else:
                     # Block expired, remove from blocked list and clear attempts
                     del self.blocked_ips[client_ip]
                     if client_ip in self.attempts:
                         self.attempts[client_ip].clear()
             
-            # Clean old timestamps from the sliding window
-            attempts_deque = self.attempts[client_ip]
-            while attempts_deque and attempts_deque[0] < now - self.window_seconds:
-                attempts_deque.popleft()
+            if blocked_msg is None:
+                # Clean old timestamps from the sliding window
+                attempts_deque = self.attempts[client_ip]
+                while attempts_deque and attempts_deque[0] < now - self.window_seconds:
+                    attempts_deque.popleft()
             
-            # Check if this IP has exceeded the maximum attempts
-            if len(attempts_deque) >= self.max_attempts:
-                # Block this IP
-                self.blocked_ips[client_ip] = now
-                log.warning(f"Connection from {peer} blocked due to too many attempts "
-                           f"({len(attempts_deque)} attempts in {self.window_seconds}s)")
-                try:
-                    connection.shutdown(socket.SHUT_RDWR)
-                except Exception:
-                    pass
-                connection.close()
-                return
+                # Check if this IP has exceeded the maximum attempts
+                if len(attempts_deque) >= self.max_attempts:
+                    # Block this IP
+                    self.blocked_ips[client_ip] = now
+                    log.warning(f"Connection from {peer} blocked due to too many attempts "
+                               f"({len(attempts_deque)} attempts in {self.window_seconds}s)")
+                    try:
+                        connection.shutdown(socket.SHUT_RDWR)
+                    except Exception:
+                        pass
+                    connection.close()
+                    return
             
-            # Record this connection attempt
-            attempts_deque.append(now)
+                # Record this connection attempt
+                attempts_deque.append(now)
+        
+        if blocked_msg is not None:
+            # in the client's framing when its request is already here; never
+            # wait for it, or idle connections from a blocked IP tie up workers
+            codec = self._drain_codec(connection)
+            try:
+                connection.settimeout(1)
+                connection.sendall(codec.encode(blocked_msg))
+                
+                connection.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            
+            connection.close()
+            return
         
         log.info(f"Connection from {peer}")
         t = threading.current_thread()
         old_name = t.name
         
+        trace = self.tracer.begin(accepted_at)
+        prof = self.profiler.begin() if self.profiler.active else None
+        command = "-"
+        
         try:
             # Changing thread name for better logging
             t.name = f"cli-{address[0]}:{address[1]}"
             
+            if self.admission.expired(sojourn):
+                log.warning("Connection from %s queued %.0fms; sending busy without reading", peer, sojourn * 1000)
+                self._reject_busy(connection)
+                return
+            
+            # Receive straight into the worker's preallocated buffer; only the new
+            # bytes are scanned for the newline, so reading is linear up to MAX_LINE.
+            view = self._recv_buffer()
+            codec = self.parser
+            size = 0
+            end = -1
             while True:
                 try:
-                    chunk = connection.recv(4096)
-                    if not chunk:
+                    nbytes = connection.recv_into(view[size:], RECV_CHUNK)
+                    if not nbytes:
                         # EOF: se já tem algo no buffer, processa como uma linha; senão encerra.
-                        if buf.strip():
-                            line = buf
+                        end = size
                         break
-                    buf += chunk
+                    scan_from = size
+                    size += nbytes
+                    
+                    # A leading MAGIC byte negotiates the length-prefixed binary framing
+                    if scan_from == 0 and view[0] == binary_protocol.MAGIC:
+                        codec = self.binary_parser
+                    
+                    if codec is self.parser:
+                        end = view.obj.find(b"\n", scan_from, size)
+                    elif size >= binary_protocol.HEADER.size:
+                        try:
+                            frame_end = binary_protocol.frame_length(view)
+                        except binary_protocol.FrameError:
+                            end = size  # let the parser report invalid_frame
+                            break
+                        if frame_end > MAX_LINE:
+                            size = frame_end  # reject up front, no need to wait for the body
+                        elif size >= frame_end:
+                            end = frame_end
                     
-                    if len(buf) > MAX_LINE:
-                        log.warning("Request line too long from %s: %d bytes (limit=%d). Closing.", peer, len(buf), MAX_LINE)
-                        log.debug("First 200 bytes from %s: %r", peer, buf[:200])
+                    if size > MAX_LINE:
+                        log.warning("Request line too long from %s: %d+ bytes (limit=%d). Closing.", peer, size, MAX_LINE)
+                        log.debug("First 200 bytes from %s: %r", peer, bytes(view[:200]))
                         
-                        msg = json.dumps({"status": "ERROR","message": "line_too_long","limit": MAX_LINE})
                         try:
-                            connection.sendall((msg + "\n").encode("utf-8"))
+                            connection.sendall(LINE_TOO_LONG_MSG if codec is self.parser else LINE_TOO_LONG_FRAME)
                         except (socket.timeout, BrokenPipeError, ConnectionResetError) as e:
                             # Quieter log to avoid clutter in DoS scenarios
                             log.debug("Failed to send 'line_too_long' to %s: %s", peer, e)
                         return # close connection at finally block
                     
-                    if b"\n" in buf:
-                        line, _rest = buf.split(b"\n", 1)
+                    if end >= 0:
                         break
                     
                 except (TimeoutError, socket.timeout):
-                    msg = json.dumps({"status": "ERROR", "message": "Timeout: no data received, closing connection"}) 
-                    
                     log.warning("Timeout waiting data from %s; sending error and closing", peer)
 
                     try:
-                        connection.sendall((msg + "\n").encode("utf-8"))
+                        connection.sendall(TIMEOUT_MSG if codec is self.parser else TIMEOUT_FRAME)
                     finally:
                         return # close connection at finally block
                     
+            # the single copy of the request: the line itself, without the newline
+            line = bytes(view[:end])
+            if trace:
+                trace.mark("recv")
+            
             # if did come useful data, process it and close connection        
-            if not line or not line.strip():
-                msg = json.dumps({"status": "ERROR", "message": "Empty request line"})
+            if not line.strip():
                 log.warning("Empty request line from %s; sending error", peer)
 
-                connection.sendall((msg + "\n").encode("utf-8"))
+                connection.sendall(EMPTY_LINE_MSG)
                 return
             
-            # parse and handle request    
-            raw = line.decode("utf-8", errors="replace")         
-            log.info("Received from %s: %s", peer, raw.strip())  
+            # parse and handle request (straight from bytes)
+            if codec is not self.parser:
+                log.info("Received from %s: <binary frame, %d bytes>", peer, len(line))
+            elif log.isEnabledFor(logging.INFO):
+                log.info("Received from %s: %s", peer, line.decode("utf-8", errors="replace").strip())
         
-            request = self.parser.parse(raw)
+            request = codec.parse(line)
+            command = request.command
+            if trace:
+                trace.mark("parse")
             
             log.info("Parsed request (%s) from %s", request.command, peer)
 
-            response = self.handler.handle(request, address[0])
-            connection.sendall((response + "\n").encode("utf-8"))
+            status, payload = self._serve(request, client_ip, codec, sojourn)
+            if trace:
+                trace.mark("handler")
+            
+            connection.sendall(payload)
+            if trace:
+                trace.mark("send")
             
-            try:  
-                status = json.loads(response).get("status") 
-            except Exception:
-                status = "?"
             log.info("Responded to %s (status=%s)", peer, status)
 
             # after sending response, just close connection
             return
                
         finally:
+            if prof is not None:
+                self.profiler.end(prof)
+            if trace:
+                self.tracer.end(trace, peer, command)
             t.name = old_name
             try:
                 connection.shutdown(socket.SHUT_RDWR)
@@ -230,17 +460,20 @@ class RendezvousServer:
         except Exception as e:
             log.debug("Keepalive tuning not supported on listener: %s", e)
 
+        self._install_signal_handlers()
+        
         server.bind((self.host, self.port))
         server.listen(backlog)
         
-        log.info("Rendezvous server listening on %s:%d (backlog=%d, workers=%d)",
-                 self.host, self.port, backlog, max_workers)
+        log.info("Rendezvous server listening on %s:%d (backlog=%d, workers=%d, max_pending=%d)",
+                 self.host, self.port, backlog, max_workers, self.admission.max_pending)
         
         with concurrent.futures.ThreadPoolExecutor(
             max_workers=max_workers, thread_name_prefix='cli'
         ) as executor:
             while True:
                 connection, address = server.accept()
+                accepted_at = time.perf_counter()
                 
                 # Also enable keepalive on accepted sockets (some OSes don't inherit all opts)
                 try:
@@ -256,7 +489,19 @@ class RendezvousServer:
                 except Exception as e:
                     log.debug("Keepalive not supported on accepted socket %s:%s: %s", *address, e)
 
+                # Bounded admission: past max_pending, answer busy right here
+                # instead of letting the connection rot in the pool's queue
+                if not self.admission.try_admit():
+                    log.warning("Overloaded (%d pending); rejecting %s:%s", self.admission.pending, *address)
+                    self._reject_busy(connection)
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                    continue
+                
                 # Hand over to the pool (limits concurrency)
-                executor.submit(self.handle_client, connection, address)
+                future = executor.submit(self.handle_client, connection, address, accepted_at)
+                future.add_done_callback(self.admission.release)
 
 
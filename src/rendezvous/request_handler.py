@@ -1,15 +1,96 @@
-import json
 from models import PeerRecord
+from protocol_parser import ProtocolParser
 from datetime import datetime, timezone
+import json
+import time
+import zlib
 import logging
 
 log = logging.getLogger("Handler")
 
+# Values accepted in the request's "compress" field
+COMPRESSORS = {
+    "zlib": lambda data: zlib.compress(data, 6),
+    "deflate": lambda data: _raw_deflate(data),
+}
+
+# A cached compressed DISCOVER body is reused while the DB version is unchanged
+# and for at most this long (expires_in values are whole seconds)
+DISCOVER_CACHE_SECONDS = 1.0
+DISCOVER_CACHE_MAX = 256
+
+
+def _raw_deflate(data):
+    c = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return c.compress(data) + c.flush()
+
+
 class RequestHandler:
-    def __init__(self, peer_db):
+    def __init__(self, peer_db, encoder=None, compress_min_bytes=1024):
         self.peer_db = peer_db
+        self.encoder = encoder or ProtocolParser()
+        self.compress_min_bytes = compress_min_bytes
+        # (namespace, encoding) -> (db version, created, payload)
+        self._discover_cache = {}
+
+    def handle(self, request, client_ip, codec=None):
+        """
+        Handle one request; returns a (status, payload_bytes) tuple.
+        `codec` is the connection's parser/encoder (default: JSON lines).
+        """
+        codec = codec or self.encoder
+        encoding = self._requested_encoding(request, codec)
+        if encoding is None:
+            response = self._dispatch(request, client_ip)
+            # (status, wire bytes): the caller sends the payload as-is and logs the
+            # status without having to parse the response back.
+            return response["status"], codec.encode(response)
+
+        cache_key = None
+        namespace = request.args.get("namespace")
+        if request.command == "DISCOVER" and (namespace is None or isinstance(namespace, str)):
+            cache_key = (namespace or None, encoding)
+            version = self.peer_db.version
+            hit = self._discover_cache.get(cache_key)
+            if hit and hit[0] == version and time.monotonic() - hit[1] < DISCOVER_CACHE_SECONDS:
+                log.info("DISCOVER ns=%r -> cached %s body (%d bytes)", namespace, encoding, len(hit[2]))
+                return "OK", hit[2]
+
+        response = self._dispatch(request, client_ip)
+        status = response["status"]
+        payload = codec.encode(response)
+        if len(payload) < self.compress_min_bytes:
+            return status, payload
+
+        payload = self._compress(status, payload, encoding)
+        if cache_key is not None and status == "OK":
+            if len(self._discover_cache) >= DISCOVER_CACHE_MAX:
+                self._discover_cache.clear()
+            self._discover_cache[cache_key] = (version, time.monotonic(), payload)
+        return status, payload
+
+    def _requested_encoding(self, request, codec):
+        """Compression asked for by the request, if supported (JSON lines only)."""
+        encoding = request.args.get("compress")
+        if encoding is None or not isinstance(codec, ProtocolParser):
+            return None
+        if not isinstance(encoding, str) or encoding not in COMPRESSORS:
+            log.debug("Ignoring unsupported compress=%r", encoding)
+            return None
+        return encoding
+
+    def _compress(self, status, payload, encoding):
+        """
+        Compressed reply: one JSON header line that line-based readers can
+        recognise by its "encoding" key, followed by `length` compressed bytes
+        which inflate to the usual response line (newline included).
+        """
+        body = COMPRESSORS[encoding](payload)
+        header = json.dumps({"status": status, "encoding": encoding,
+                             "length": len(body), "size": len(payload)})
+        return (header + "\n").encode("utf-8") + body
 
-    def handle(self, request, client_ip):
+    def _dispatch(self, request, client_ip):
         cmd = request.command
         args = request.args
         
@@ -26,7 +107,7 @@ class RequestHandler:
             
             if not isinstance(name, str) or not name or len(name) > 64:
                 log.warning("REGISTER invalid (name)")
-                return json.dumps({"status": "ERROR", "message": "bad_name"})
+                return {"status": "ERROR", "message": "bad_name"}
             
             # TTL clamp (1 .. 86400)
             try:
@@ -35,12 +116,12 @@ class RequestHandler:
                     ttl = max(1, min(ttl, 86400))
             except (ValueError, TypeError):
                 log.warning("REGISTER invalid (ttl)")
-                return json.dumps({"status": "ERROR", "message": "bad_ttl"})
+                return {"status": "ERROR", "message": "bad_ttl"}
             
             #lets validate required fields
             if not isinstance(namespace, str) or not namespace or len(namespace) > 64:
                 log.warning("REGISTER invalid (namespace)")
-                return json.dumps({"status": "ERROR", "message": "bad_namespace"})
+                return {"status": "ERROR", "message": "bad_namespace"}
             
             try:
                 port = int(port)
@@ -48,7 +129,7 @@ class RequestHandler:
                     raise ValueError()
             except (ValueError, TypeError):
                 log.warning("REGISTER invalid (port)")
-                return json.dumps({"status": "ERROR", "message": "bad_port"})
+                return {"status": "ERROR", "message": "bad_port"}
             
             try:
                 peer = PeerRecord(
@@ -63,16 +144,16 @@ class RequestHandler:
                 
                 log.info("REGISTER OK: %s:%d ns=%s ttl=%d", peer.ip, peer.port, peer.namespace, peer.ttl)
                 
-                return json.dumps({
+                return {
                     "status": "OK",
                     "ttl": peer.ttl,
                     "ip": peer.ip,       
                     "port": peer.port    
-                })  
+                }  
                           
             except Exception as e:
                 log.exception("REGISTER failed")
-                return json.dumps({"status": "ERROR", "message": str(e)})
+                return {"status": "ERROR", "message": str(e)}
 
             
         elif cmd == "DISCOVER":
@@ -91,7 +172,7 @@ class RequestHandler:
             
             log.info("DISCOVER ns=%r -> %d peer(s)", namespace, len(peer_list)) 
             
-            return json.dumps({"status": "OK", "peers": peer_list})
+            return {"status": "OK", "peers": peer_list}
         
         elif cmd == "UNREGISTER":
             try:
@@ -104,19 +185,19 @@ class RequestHandler:
                         port = int(port)
                     except (ValueError, TypeError):
                         log.warning(f"UNREGISTER invalid (port:{port})")
-                        return json.dumps({"status": "ERROR", "message": f"bad_port ({port})"})
+                        return {"status": "ERROR", "message": f"bad_port ({port})"}
                     
                 self.peer_db.remove_peer(client_ip, namespace, name=name, port=port)
                 
                 log.info("UNREGISTER ip=%s ns=%r name=%r port=%r OK", 
                          client_ip, namespace, name, port)
 
-                return json.dumps({"status": "OK"})
+                return {"status": "OK"}
             
             except Exception as e:
                 log.exception("UNREGISTER failed")
-                return json.dumps({"status": "ERROR", "message": str(e)})
+                return {"status": "ERROR", "message": str(e)}
 
         log.warning("Unknown command: %s", cmd)
-        return json.dumps({"status": "ERROR", "message": "Unknown command"})    
+        return {"status": "ERROR", "message": "Unknown command"}    
 
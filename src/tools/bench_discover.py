@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+DISCOVER read-path contention benchmark (in-process, no sockets).
+
+Measures PeerDatabase.get_peers throughput and latency of N reader threads,
+first alone and then while a writer thread REGISTERs/UNREGISTERs at
+--writes-per-sec (each write: full JSON rewrite + fsync). With lock-free
+snapshot reads the two phases should stay close. --writes-per-sec 0 runs the
+writer flat out: then readers mostly lose CPU/GIL time to it, which the DB
+lock counters (readers never take the lock) tell apart from lock waits.
+"""
+import argparse, logging, os, sys, tempfile, threading, time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "rendezvous"))
+
+from models import PeerRecord
+from peer_db import PeerDatabase
+
+def make_peer(i: int, namespaces: int) -> PeerRecord:
+    return PeerRecord(
+        ip=f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+        port=4000 + i % 1000,
+        name=f"peer{i}",
+        namespace=f"ns{i % namespaces}",
+        ttl=3600,
+        timestamp=datetime.now(timezone.utc),
+    )
+
+def run_readers(db: PeerDatabase, readers: int, seconds: float, namespace):
+    """Total get_peers calls per second across all reader threads, and sorted call latencies."""
+    stop = threading.Event()
+    counts = [0] * readers
+    latencies = [None] * readers
+
+    def reader(idx: int):
+        n = 0
+        lat = []
+        clock = time.perf_counter
+        while not stop.is_set():
+            t0 = clock()
+            for p in db.get_peers(namespace):
+                pass  # iterate, like the DISCOVER handler does
+            lat.append(clock() - t0)
+            n += 1
+            time.sleep(0)  # release the GIL like the socket send of a real request
+        counts[idx] = n
+        latencies[idx] = lat
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads: t.join()
+    rate = sum(counts) / (time.perf_counter() - t0)
+    return rate, sorted(x for lat in latencies for x in lat)
+
+def pct_us(sorted_values, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))] * 1e6
+
+def main():
+    ap = argparse.ArgumentParser(description="DISCOVER vs REGISTER contention benchmark")
+    ap.add_argument("--peers", type=int, default=500, help="Peers preloaded in the DB")
+    ap.add_argument("--namespaces", type=int, default=10)
+    ap.add_argument("--readers", type=int, default=8, help="Concurrent DISCOVER threads")
+    ap.add_argument("--seconds", type=float, default=3.0, help="Duration of each phase")
+    ap.add_argument("--writes-per-sec", type=float, default=5.0,
+                    help="REGISTER/UNREGISTER rate of the writer; the default is already well above "
+                         "what TTL renewals of --peers peers cause (0 = as fast as possible)")
+    ap.add_argument("--global", dest="global_discover", action="store_true",
+                    help="DISCOVER without namespace (all peers)")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = PeerDatabase(os.path.join(tmp, "peers.json"))
+        for i in range(args.peers):
+            db.add_peer(make_peer(i, args.namespaces))
+        namespace = None if args.global_discover else "ns0"
+
+        lock = db._lock
+        lock.enabled = True
+        lock.reset()
+        idle, idle_lat = run_readers(db, args.readers, args.seconds, namespace)
+        idle_lock = lock.snapshot()
+
+        stop = threading.Event()
+        writes = [0]
+        def writer():
+            i = args.peers
+            pause = 2.0 / args.writes_per_sec if args.writes_per_sec > 0 else 0.0
+            next_at = time.perf_counter()
+            while not stop.is_set():
+                db.add_peer(make_peer(i, args.namespaces))
+                db.remove_peer(make_peer(i, args.namespaces).ip, f"ns{i % args.namespaces}")
+                writes[0] += 2
+                i += 1
+                if pause:
+                    next_at += pause
+                    stop.wait(max(0.0, next_at - time.perf_counter()))
+
+        lock.reset()
+        w = threading.Thread(target=writer)
+        w.start()
+        busy, busy_lat = run_readers(db, args.readers, args.seconds, namespace)
+        stop.set()
+        w.join()
+        busy_lock = lock.snapshot()
+
+    print(f"readers={args.readers} peers={args.peers} namespace={namespace!r}")
+    print(f"  DISCOVER/s, no writers     : {idle:12.0f}  "
+          f"(p50 {pct_us(idle_lat, 0.50):.1f}us, p99 {pct_us(idle_lat, 0.99):.1f}us)")
+    print(f"  DISCOVER/s, writer running : {busy:12.0f}  "
+          f"(p50 {pct_us(busy_lat, 0.50):.1f}us, p99 {pct_us(busy_lat, 0.99):.1f}us, "
+          f"{writes[0] / args.seconds:.0f} writes/s)")
+    print(f"  ratio                      : {busy / idle:12.2f}")
+    for label, st in (("no writers", idle_lock), ("writer running", busy_lock)):
+        print(f"  DB lock, {label:17s} : {st['acquisitions']:12d} acquisitions, "
+              f"{st['contended']} contended, {st['wait_ms']:.3f}ms waiting")
+
+if __name__ == "__main__":
+    main()
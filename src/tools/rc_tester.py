@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
-import argparse, json, socket, time, re, sys
-from typing import Any, Dict
+import argparse, json, socket, time, re, sys, zlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# binary framing codec lives with the server sources
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "rendezvous"))
 
 def build_line(case: Dict[str, Any]) -> bytes:
     mode = case.get("mode", "json")
@@ -41,6 +45,79 @@ def recv_line(sock: socket.socket, timeout: float) -> str:
     # EOF sem newline: devolve tudo que tiver
     return buf.decode("utf-8", errors="replace")
 
+def recv_response(sock: socket.socket, timeout: float) -> str:
+    """
+    Like recv_line, but if the first line is a compression header (has an
+    "encoding" key), reads the `length` bytes after it and inflates them.
+    """
+    sock.settimeout(timeout)
+    buf = b""
+    while b"\n" not in buf:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return buf.decode("utf-8", errors="replace")
+        buf += chunk
+    line, rest = buf.split(b"\n", 1)
+    try:
+        header = json.loads(line)
+    except Exception:
+        header = None
+    if not isinstance(header, dict) or "encoding" not in header:
+        return line.decode("utf-8", errors="replace")
+
+    length = int(header["length"])
+    while len(rest) < length:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        rest += chunk
+    wbits = -15 if header["encoding"] == "deflate" else 15
+    return zlib.decompress(rest[:length], wbits).decode("utf-8").rstrip("\n")
+
+def recv_frame(sock: socket.socket, timeout: float) -> bytes:
+    from binary_protocol import HEADER, frame_length
+    sock.settimeout(timeout)
+    buf = b""
+    total = None
+    while total is None or len(buf) < total:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        buf += chunk
+        if total is None and len(buf) >= HEADER.size:
+            total = frame_length(buf)
+    return buf
+
+def exchange(case: Dict[str, Any], host: str, port: int, timeout: float, framing: str):
+    """Send one case using the given framing; returns (resp_text, got_obj)."""
+    if framing == "binary":
+        from binary_protocol import encode_frame, decode_frame
+        payload = encode_frame(case["send"])
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(payload)
+            got_obj = decode_frame(recv_frame(sock, timeout))
+        # checks (regex included) run over the JSON rendering of the decoded object
+        return json.dumps(got_obj), got_obj
+
+    payload = build_line(case)
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(payload)
+        resp_text = recv_response(sock, timeout)
+    got_obj = None
+    try:
+        got_obj = json.loads(resp_text)
+    except Exception:
+        pass
+    return resp_text, got_obj
+
+def without_drift(obj: Any) -> Any:
+    # expires_in may tick between the two exchanges of a "both" run
+    if isinstance(obj, dict):
+        return {k: without_drift(v) for k, v in obj.items() if k != "expires_in"}
+    if isinstance(obj, list):
+        return [without_drift(v) for v in obj]
+    return obj
+
 def is_subset(expected: Any, got: Any) -> bool:
     if isinstance(expected, dict):
         if not isinstance(got, dict):
@@ -66,30 +143,41 @@ def check_types(type_spec: Dict[str, str], got_obj: Dict[str, Any]) -> bool:
             return False
     return True
 
-def run_case(case: Dict[str, Any], host: str, port: int, timeout: float, default_delay: float) -> bool:
+def run_case(case: Dict[str, Any], host: str, port: int, timeout: float, default_delay: float,
+             framing: str = "line") -> Optional[bool]:
     name = case.get("name", "<no-name>")
     delay = float(case.get("delay", default_delay or 0))
     if delay > 0:
         time.sleep(delay)
 
+    if framing != "line" and case.get("mode", "json") != "json":
+        print(f"[{name}] SKIP (mode {case.get('mode')!r} is line-only)")
+        return None
+
     try:
-        payload = build_line(case)
+        build_line(case)
     except Exception as e:
         print(f"[{name}] BUILD ERROR: {e}")
         return False
 
-    resp_text = ""
-    try:
-        with socket.create_connection((host, port), timeout=timeout) as sock:
-            sock.sendall(payload)
-            resp_text = recv_line(sock, timeout)
-    except (ConnectionRefusedError, TimeoutError, socket.timeout) as e:
-        print(f"[{name}] NET ERROR: {e}")
-        return False
-    except Exception as e:
-        print(f"[{name}] UNEXPECTED ERROR: {e}")
+    results = []
+    for fr in (("line", "binary") if framing == "both" else (framing,)):
+        try:
+            results.append(exchange(case, host, port, timeout, fr))
+        except (ConnectionRefusedError, TimeoutError, socket.timeout) as e:
+            print(f"[{name}] NET ERROR ({fr}): {e}")
+            return False
+        except Exception as e:
+            print(f"[{name}] UNEXPECTED ERROR ({fr}): {e}")
+            return False
+
+    if len(results) == 2 and without_drift(results[0][1]) != without_drift(results[1][1]):
+        print(f"[{name}] FAIL framing mismatch:\n  line  ={results[0][0]}\n  binary={results[1][0]}")
         return False
 
+    # expectations are checked against the (first) response
+    resp_text, got_obj = results[0]
+
     exp = case.get("expect", {})
     ok = True
 
@@ -99,14 +187,7 @@ def run_case(case: Dict[str, Any], host: str, port: int, timeout: float, default
             print(f"[{name}] FAIL regex: {exp['regex']}\n  got: {resp_text}")
             ok = False
 
-    # 2) Parse JSON (se der)
-    got_obj = None
-    try:
-        got_obj = json.loads(resp_text)
-    except Exception:
-        pass
-
-    # 3) Checagens estruturais
+    # 2) Checagens estruturais
     if "status" in exp and got_obj is not None:
         if got_obj.get("status") != exp["status"]:
             print(f"[{name}] FAIL status: expected {exp['status']}, got {got_obj.get('status')}; raw={resp_text}")
@@ -144,17 +225,21 @@ def main():
     ap.add_argument("--port", type=int, default=5000)
     ap.add_argument("--timeout", type=float, default=5.0, help="Socket connect/read timeout seconds")
     ap.add_argument("--delay", type=float, default=0.0, help="Default delay (seconds) before each case (can be overridden per-case)")
+    ap.add_argument("--framing", choices=["line", "binary", "both"], default="line",
+                    help="Wire format: JSON lines (default), binary frames, or both "
+                         "(each case sent in both formats; responses must match)")
     args = ap.parse_args()
 
     with open(args.test_file, "r", encoding="utf-8") as f:
         cases = json.load(f)
 
-    passed = 0
+    passed = skipped = 0
     for case in cases:
-        ok = run_case(case, args.host, args.port, args.timeout, args.delay)
-        if ok: passed += 1
-    total = len(cases)
-    print(f"\nSummary: {passed}/{total} passed")
+        ok = run_case(case, args.host, args.port, args.timeout, args.delay, args.framing)
+        if ok is None: skipped += 1
+        elif ok: passed += 1
+    total = len(cases) - skipped
+    print(f"\nSummary: {passed}/{total} passed" + (f" ({skipped} skipped)" if skipped else ""))
     sys.exit(0 if passed == total else 1)
 
 if __name__ == "__main__":
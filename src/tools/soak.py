@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Long-running soak test for the rendezvous server.
+
+Runs the server in-process (default) or as a subprocess, drives churny traffic
+at it (a rolling pool of source IPs that keeps bringing in new clients, short
+TTLs, constant REGISTER/UNREGISTER turnover, DISCOVERs) and samples over time:
+
+  - RSS of the server process
+  - latency percentiles and error counts per interval
+  - peer count
+  - in-process only: gc object count (+ per-type growth), tracked/blocked IPs
+    in RendezvousServer, threads, and optionally tracemalloc top allocators
+
+At the end it compares an early window (after --warmup) with the final window
+and exits 1 when any growth/drift exceeds its threshold. In-process, it also
+fails if a pool thread is still named cli-<ip>:<port> once traffic has stopped.
+
+  python soak.py --duration 3600 --clients 16 --csv soak.csv
+"""
+import argparse, collections, csv, gc, json, os, random, socket, subprocess, sys
+import tempfile, threading, time, tracemalloc, zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "rendezvous"
+
+# ---------------------------------------------------------------- helpers
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Current resident set size (Linux /proc); None where unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+class SourceIps:
+    """
+    Source addresses in 127.0.0.0/8 (all routed to loopback on Linux).
+
+    fixed:   the same `size` addresses for the whole run.
+    rolling: a window of `size` addresses that slides forward by `rate` new
+             addresses per second, so the server keeps seeing new clients while
+             old ones go idle. Per-IP state that is never pruned keeps growing.
+
+    Falls back to 127.0.0.1 only when 127.x.y.z addresses can't be bound.
+    """
+    SPACE = (1 << 24) - 1
+
+    def __init__(self, size: int, mode: str = "rolling", rate: float = 50.0):
+        self.size = size
+        self.rolling = mode == "rolling"
+        self.rate = rate
+        self.started = time.monotonic()
+        try:
+            with socket.socket() as s:
+                s.bind((self.address(self.SPACE - 1), 0))
+            self.loopback_only = False
+        except OSError:
+            print("WARN: cannot bind 127.x.y.z source addresses; using 127.0.0.1 only")
+            self.loopback_only = True
+
+    @classmethod
+    def address(cls, n: int) -> str:
+        i = 1 + n % cls.SPACE
+        return f"127.{(i >> 16) & 255}.{(i >> 8) & 255}.{(i & 255) or 1}"
+
+    def pick(self, rnd: random.Random) -> str:
+        if self.loopback_only:
+            return "127.0.0.1"
+        first = int((time.monotonic() - self.started) * self.rate) if self.rolling else 0
+        return self.address(first + rnd.randrange(self.size))
+
+    def describe(self) -> str:
+        if self.loopback_only:
+            return "127.0.0.1"
+        return f"{self.size} rolling (+{self.rate:g}/s)" if self.rolling else f"{self.size} fixed"
+
+def request(host: str, port: int, payload: Dict[str, Any], source_ip: str, timeout: float) -> Dict[str, Any]:
+    with socket.create_connection((host, port), timeout=timeout, source_address=(source_ip, 0)) as sock:
+        sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        buf = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+    line, _, rest = buf.partition(b"\n")
+    obj = json.loads(line)
+    if "encoding" in obj:  # compressed reply: header line + body
+        wbits = -15 if obj["encoding"] == "deflate" else 15
+        obj = json.loads(zlib.decompress(rest[:obj["length"]], wbits))
+    return obj
+
+# ---------------------------------------------------------------- server
+
+class InProcessServer:
+    """RendezvousServer on a daemon thread of this process (full introspection)."""
+    def __init__(self, port: int, workdir: str, max_attempts: Optional[int]):
+        sys.path.insert(0, str(SERVER_DIR))
+        os.chdir(workdir)  # peers.json lives in the working directory
+        from rendezvous import RendezvousServer
+        # rate limiting off unless asked: the soak wants steady traffic
+        self.server = RendezvousServer("127.0.0.1", port,
+                                       max_attempts=max_attempts if max_attempts is not None else 10**9)
+        self.pid = os.getpid()
+        threading.Thread(target=self.server.start, name="soak-server", daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        srv = self.server
+        with srv.attempts_lock:
+            tracked, blocked = len(srv.attempts), len(srv.blocked_ips)
+        return {
+            "peers": len(srv.peer_db.peers),
+            "tracked_ips": tracked,
+            "blocked_ips": blocked,
+            "threads": threading.active_count(),
+            "cli_threads": len(client_named_threads()),
+        }
+
+    def stop(self):
+        pass  # daemon thread dies with the process
+
+class SubprocessServer:
+    """main.py in a child process; only externally visible metrics."""
+    def __init__(self, port: int, workdir: str, max_attempts: Optional[int]):
+        if max_attempts is not None:
+            print("WARN: --max-attempts only applies in-process; main.py uses the default (50/min per IP)")
+        self.proc = subprocess.Popen(
+            [sys.executable, str(SERVER_DIR / "main.py"), "--host", "127.0.0.1", "--port", str(port),
+             "--log-mode", "file", "--log-file", os.path.join(workdir, "server.log")],
+            cwd=workdir,
+        )
+        self.pid = self.proc.pid
+        self.port = port
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            reply = request("127.0.0.1", self.port, {"type": "DISCOVER", "compress": "zlib"}, "127.0.0.1", 5.0)
+            peers = len(reply.get("peers", []))
+        except Exception:
+            peers = None
+        return {"peers": peers}
+
+    def stop(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+# ---------------------------------------------------------------- traffic
+
+class Traffic:
+    """Client threads doing REGISTER / DISCOVER / UNREGISTER with churn."""
+    def __init__(self, args, port: int, ips: SourceIps):
+        self.args = args
+        self.port = port
+        self.ips = ips
+        self.stop = threading.Event()
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.counts = collections.Counter()
+
+    def drain(self):
+        with self.lock:
+            lat, self.latencies = self.latencies, []
+            counts, self.counts = self.counts, collections.Counter()
+        return sorted(lat), counts
+
+    def client(self, seed: int):
+        a = self.args
+        rnd = random.Random(seed)
+        while not self.stop.is_set():
+            ip = self.ips.pick(rnd)
+            ns = f"soak-{rnd.randrange(a.namespaces)}"
+            name = f"p{rnd.randrange(a.names)}"  # names recycle -> constant turnover
+            op = rnd.random()
+            if op < 0.5:
+                payload = {"type": "REGISTER", "namespace": ns, "name": name,
+                           "port": rnd.randint(1024, 65535), "ttl": rnd.randint(1, a.ttl)}
+            elif op < 0.9:
+                payload = {"type": "DISCOVER", "namespace": ns}
+                if rnd.random() < 0.1:
+                    payload = {"type": "DISCOVER", "compress": "zlib"}
+            else:
+                payload = {"type": "UNREGISTER", "namespace": ns, "name": name}
+
+            t0 = time.perf_counter()
+            try:
+                reply = request("127.0.0.1", self.port, payload, ip, a.timeout)
+                if reply.get("status") == "OK":
+                    outcome = "ok"
+                elif reply.get("message") == "busy":
+                    outcome = "busy"
+                elif "blocked" in str(reply.get("message", "")):
+                    outcome = "blocked"
+                else:
+                    outcome = "error"
+            except Exception:
+                outcome = "neterr"
+            elapsed = time.perf_counter() - t0
+            with self.lock:
+                self.counts[outcome] += 1
+                if outcome == "ok":
+                    self.latencies.append(elapsed)
+            if a.think_ms:
+                time.sleep(a.think_ms / 1000.0)
+
+    def start(self):
+        for i in range(self.args.clients):
+            t = threading.Thread(target=self.client, args=(i,), name=f"soak-cli-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def join(self):
+        """Stop the clients and wait for their last requests to finish."""
+        self.stop.set()
+        deadline = time.monotonic() + self.args.timeout + 1.0
+        for t in self.threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+# ---------------------------------------------------------------- sampling
+
+def sample(server, traffic: Traffic, started: float, in_process: bool, top_types: bool):
+    lat, counts = traffic.drain()
+    s: Dict[str, Any] = {
+        "t": round(time.monotonic() - started, 1),
+        "rss_mb": rss_mb(server.pid),
+        "requests": sum(counts.values()),
+        "errors": counts["error"] + counts["neterr"],
+        "busy": counts["busy"],
+        "blocked": counts["blocked"],
+        "p50_ms": None if not lat else round(percentile(lat, 0.50) * 1000, 2),
+        "p95_ms": None if not lat else round(percentile(lat, 0.95) * 1000, 2),
+        "p99_ms": None if not lat else round(percentile(lat, 0.99) * 1000, 2),
+    }
+    s.update(server.stats())
+    if in_process:
+        objs = gc.get_objects()
+        s["objects"] = len(objs)
+        if top_types:
+            s["_types"] = collections.Counter(type(o).__name__ for o in objs)
+        del objs
+    return s
+
+def client_named_threads() -> List[str]:
+    """Threads carrying the per-request name the server gives pool workers."""
+    return [t.name for t in threading.enumerate() if t.name.startswith("cli-")]
+
+def window_mean(samples: List[Dict[str, Any]], key: str) -> Optional[float]:
+    values = [s[key] for s in samples if s.get(key) is not None]
+    return sum(values) / len(values) if values else None
+
+def check_drift(samples, args) -> List[str]:
+    """Compare the first post-warmup window with the final one."""
+    warm = [s for s in samples if s["t"] >= args.warmup]
+    if len(warm) < 2 * args.window:
+        return [f"not enough samples after warmup ({len(warm)} < {2 * args.window}); increase --duration"]
+    early, late = warm[:args.window], warm[-args.window:]
+    failures = []
+
+    def growth(key):
+        a, b = window_mean(early, key), window_mean(late, key)
+        return (a, b) if a is not None and b is not None else (None, None)
+
+    a, b = growth("rss_mb")
+    if a is not None and b - a > args.max_rss_growth_mb:
+        failures.append(f"RSS grew {b - a:.1f} MB ({a:.1f} -> {b:.1f}), limit {args.max_rss_growth_mb} MB")
+
+    for key, limit in (("objects", args.max_object_growth), ("peers", args.max_peer_growth),
+                       ("tracked_ips", args.max_tracked_ip_growth)):
+        a, b = growth(key)
+        if a is not None and limit is not None and a > 0 and (b - a) / a > limit:
+            failures.append(f"{key} grew {100 * (b - a) / a:.0f}% ({a:.0f} -> {b:.0f}), limit {100 * limit:.0f}%")
+
+    a, b = growth("p99_ms")
+    if a is not None and a > 0 and b / a > args.max_p99_drift:
+        failures.append(f"p99 latency drifted x{b / a:.2f} ({a:.1f} -> {b:.1f} ms), limit x{args.max_p99_drift}")
+
+    total = sum(s["requests"] for s in warm)
+    errors = sum(s["errors"] for s in warm)
+    if total and errors / total > args.max_error_rate:
+        failures.append(f"error rate {100 * errors / total:.2f}% over limit {100 * args.max_error_rate:.2f}%")
+    return failures
+
+def report_types(samples, args, top: int):
+    warm = [s for s in samples if s["t"] >= args.warmup and "_types" in s]
+    if len(warm) < 2:
+        return
+    delta = warm[-1]["_types"].copy()
+    delta.subtract(warm[0]["_types"])
+    print("\nTop object-count growth by type (after warmup):")
+    for name, d in delta.most_common(top):
+        if d > 0:
+            print(f"  {name:30s} +{d}")
+
+def report_tracemalloc(first, last, top: int):
+    print("\nTop allocation growth (tracemalloc, after warmup):")
+    for stat in last.compare_to(first, "lineno")[:top]:
+        print(f"  {stat}")
+
+# ---------------------------------------------------------------- main
+
+def main():
+    ap = argparse.ArgumentParser(description="Rendezvous soak test with memory/latency drift detection")
+    ap.add_argument("--mode", choices=["inprocess", "subprocess"], default="inprocess")
+    ap.add_argument("--duration", type=float, default=600, help="Total run time in seconds")
+    ap.add_argument("--interval", type=float, default=10, help="Seconds between samples")
+    ap.add_argument("--warmup", type=float, default=60, help="Seconds ignored before drift comparison")
+    ap.add_argument("--window", type=int, default=3, help="Samples averaged at each end of the comparison")
+    ap.add_argument("--clients", type=int, default=8, help="Concurrent client threads")
+    ap.add_argument("--think-ms", type=float, default=5, help="Pause between requests per client")
+    ap.add_argument("--timeout", type=float, default=5.0, help="Client socket timeout")
+    ap.add_argument("--ips", type=int, default=4096, help="Size of the source-IP pool")
+    ap.add_argument("--ip-mode", choices=["rolling", "fixed"], default="rolling",
+                    help="rolling: the pool keeps sliding to new addresses; fixed: same addresses all run")
+    ap.add_argument("--ip-rate", type=float, default=50.0,
+                    help="New source addresses per second in rolling mode")
+    ap.add_argument("--namespaces", type=int, default=20)
+    ap.add_argument("--names", type=int, default=2000, help="Peer names per namespace (recycled)")
+    ap.add_argument("--ttl", type=int, default=5, help="Max TTL of registrations (seconds)")
+    ap.add_argument("--max-attempts", type=int, default=None,
+                    help="Server per-IP attempt limit (in-process only; default: unlimited)")
+    ap.add_argument("--tracemalloc", type=int, default=0, metavar="N",
+                    help="Trace allocations and report the top N growing sites (in-process; slow)")
+    ap.add_argument("--top-types", type=int, default=10, help="Report the top N growing object types (in-process)")
+    ap.add_argument("--csv", help="Write samples to this CSV file")
+    ap.add_argument("--max-rss-growth-mb", type=float, default=32.0)
+    ap.add_argument("--max-object-growth", type=float, default=0.25, help="Relative growth of gc objects")
+    ap.add_argument("--max-peer-growth", type=float, default=0.5, help="Relative growth of the peer count")
+    ap.add_argument("--max-tracked-ip-growth", type=float, default=0.5,
+                    help="Relative growth of RendezvousServer.attempts (in-process)")
+    ap.add_argument("--max-p99-drift", type=float, default=3.0, help="Late/early p99 latency ratio")
+    ap.add_argument("--max-error-rate", type=float, default=0.01)
+    args = ap.parse_args()
+
+    in_process = args.mode == "inprocess"
+    workdir = tempfile.mkdtemp(prefix="rdv-soak-")
+    port = free_port()
+
+    if in_process:
+        import logging
+        logging.basicConfig(level=logging.ERROR)
+        if args.tracemalloc:
+            tracemalloc.start(10)
+        server = InProcessServer(port, workdir, args.max_attempts)
+    else:
+        server = SubprocessServer(port, workdir, args.max_attempts)
+    time.sleep(1.0)
+
+    ips = SourceIps(args.ips, args.ip_mode, args.ip_rate)
+    traffic = Traffic(args, port, ips)
+    print(f"soak: mode={args.mode} port={port} workdir={workdir} ips={ips.describe()} "
+          f"clients={args.clients} duration={args.duration}s")
+    started = time.monotonic()
+    traffic.start()
+
+    samples: List[Dict[str, Any]] = []
+    snap_first = snap_last = None
+    columns = ["t", "rss_mb", "requests", "errors", "busy", "blocked", "p50_ms", "p95_ms", "p99_ms",
+               "peers", "tracked_ips", "blocked_ips", "threads", "cli_threads", "objects"]
+    try:
+        while time.monotonic() - started < args.duration:
+            time.sleep(args.interval)
+            s = sample(server, traffic, started, in_process, bool(args.top_types))
+            samples.append(s)
+            print("  " + " ".join(f"{c}={s[c]}" for c in columns if s.get(c) is not None), flush=True)
+            if args.tracemalloc and in_process and s["t"] >= args.warmup:
+                snap_last = tracemalloc.take_snapshot()
+                if snap_first is None:
+                    snap_first = snap_last
+    except KeyboardInterrupt:
+        print("interrupted; evaluating what was collected")
+    finally:
+        traffic.join()
+        # a worker that served a request must have its pool name back by now
+        leftover = client_named_threads() if in_process else []
+        server.stop()
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+            w.writeheader()
+            w.writerows(samples)
+
+    if in_process and args.top_types:
+        report_types(samples, args, args.top_types)
+    if snap_first is not None and snap_last is not snap_first:
+        report_tracemalloc(snap_first, snap_last, args.tracemalloc)
+
+    failures = check_drift(samples, args)
+    if leftover:
+        failures.append(f"{len(leftover)} thread(s) still named cli-<ip>:<port> after traffic stopped: "
+                        + ", ".join(sorted(leftover)[:5]))
+    print()
+    for msg in failures:
+        print(f"FAIL {msg}")
+    print("Soak " + ("FAILED" if failures else "passed"))
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()